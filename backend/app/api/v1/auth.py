@@ -197,8 +197,10 @@ async def logout(
 
     if jti:
         # best-effort insert; ignore duplicates
-        exists = db.query(RevokedToken).filter(RevokedToken.jti == jti).first()
-        if not exists:
+        already_revoked = db.query(
+            db.query(RevokedToken).filter(RevokedToken.jti == jti).exists()
+        ).scalar()
+        if not already_revoked:
             expires_at = None
             try:
                 if exp:
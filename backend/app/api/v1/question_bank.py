@@ -249,8 +249,10 @@ def generate_questions_with_ai(
         )
 
     if payload.subject_id:
-        subject = db.query(Subject).filter(Subject.id == payload.subject_id, Subject.is_active == True).first()
-        if not subject:
+        subject_exists = db.query(
+            db.query(Subject).filter(Subject.id == payload.subject_id, Subject.is_active == True).exists()
+        ).scalar()
+        if not subject_exists:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Subject not found",
@@ -16,8 +16,10 @@ def create_subject(
     """
     Create a new subject (Admin and Teacher only)
     """
-    # Check if subject code already exists
-    existing = db.query(Subject).filter(Subject.code == subject.code).first()
+    # Check if subject code already exists (EXISTS scalar: no row hydration)
+    existing = db.query(
+        db.query(Subject).filter(Subject.code == subject.code).exists()
+    ).scalar()
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -25,7 +27,9 @@ def create_subject(
         )
     
     # Check if subject name already exists
-    existing_name = db.query(Subject).filter(Subject.name == subject.name).first()
+    existing_name = db.query(
+        db.query(Subject).filter(Subject.name == subject.name).exists()
+    ).scalar()
     if existing_name:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -110,7 +114,9 @@ def update_subject(
     
     # Check for duplicate code if updating
     if subject_update.code and subject_update.code != subject.code:
-        existing = db.query(Subject).filter(Subject.code == subject_update.code).first()
+        existing = db.query(
+            db.query(Subject).filter(Subject.code == subject_update.code).exists()
+        ).scalar()
         if existing:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -25,8 +25,10 @@ async def create_user(
             detail="Teachers can only create student accounts"
         )
     
-    # Check if email already exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    # Check if email already exists (EXISTS scalar: no row hydration)
+    existing_user = db.query(
+        db.query(User).filter(User.email == user_data.email).exists()
+    ).scalar()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -35,7 +37,9 @@ async def create_user(
     
     # Check if provided user ID already exists (for students/teachers)
     if user_data.role in {"student", "teacher"} and user_data.student_id:
-        existing_user_id = db.query(User).filter(User.student_id == user_data.student_id).first()
+        existing_user_id = db.query(
+            db.query(User).filter(User.student_id == user_data.student_id).exists()
+        ).scalar()
         if existing_user_id:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -141,7 +145,7 @@ async def bulk_upload_users(
                     continue
                 
                 # Check if email already exists
-                if db.query(User).filter(User.email == email).first():
+                if db.query(db.query(User).filter(User.email == email).exists()).scalar():
                     errors.append({
                         "row": row_num,
                         "email": email,
@@ -169,7 +173,7 @@ async def bulk_upload_users(
                         })
                         continue
                     
-                    if db.query(User).filter(User.student_id == student_id).first():
+                    if db.query(db.query(User).filter(User.student_id == student_id).exists()).scalar():
                         errors.append({
                             "row": row_num,
                             "email": email,
@@ -1,9 +1,15 @@
-from pydantic_settings import BaseSettings
+from functools import cached_property, lru_cache
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import field_validator
 from typing import List
 
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
+
     DATABASE_URL: str = "sqlite:///./quizapp.db"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
     SECRET_KEY: str = "change-this-secret-key"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
@@ -23,8 +29,10 @@ class Settings(BaseSettings):
             return value.strip()
         return value
     
-    @property
+    @cached_property
     def cors_origins_list(self) -> List[str]:
+        # Parsed once and cached; the credentials downgrade below must not
+        # re-fire on every read of this property.
         origins = [origin.strip() for origin in self.CORS_ORIGINS.split(",") if origin.strip()]
         if self.CORS_ALLOW_CREDENTIALS and "*" in origins:
             # Browsers block '*' with credentials; also unsafe.
@@ -32,8 +40,12 @@ class Settings(BaseSettings):
             print("⚠️  CORS_ORIGINS contains '*' while credentials are enabled; disabling credentials")
             self.CORS_ALLOW_CREDENTIALS = False
         return origins
-    
-    class Config:
-        env_file = ".env"
 
-settings = Settings()
+
+@lru_cache
+def get_settings() -> Settings:
+    """Cached settings factory: .env is read and parsed at most once per process."""
+    return Settings()
+
+
+settings = get_settings()
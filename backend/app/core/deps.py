@@ -33,7 +33,11 @@ async def get_current_user(
     # Session checks
     jti = payload.get("jti")
     if jti:
-        revoked = db.query(RevokedToken).filter(RevokedToken.jti == jti).first()
+        # EXISTS probe: the server returns a single bool instead of a full
+        # row hydrated into an ORM object just for a truthiness check.
+        revoked = db.query(
+            db.query(RevokedToken).filter(RevokedToken.jti == jti).exists()
+        ).scalar()
         if revoked:
             raise credentials_exception
 
@@ -13,6 +13,8 @@ if settings.DATABASE_URL.startswith('sqlite'):
 
 engine_kwargs = {
     "connect_args": connect_args,
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
     "pool_pre_ping": True,  # Verify connections before using
     "pool_recycle": 3600,   # Recycle connections after 1 hour
     "echo": False,
@@ -21,6 +23,8 @@ engine_kwargs = {
 # Vercel/Serverless: disable connection pooling to avoid stale pooled connections across invocations
 if os.getenv('VERCEL') or os.getenv('SERVERLESS'):
     engine_kwargs["poolclass"] = NullPool
+    engine_kwargs.pop("pool_size")
+    engine_kwargs.pop("max_overflow")
 
 engine = create_engine(settings.DATABASE_URL, **engine_kwargs)
 
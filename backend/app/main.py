@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
 from sqlalchemy import inspect, text
 from sqlalchemy.exc import IntegrityError
@@ -9,7 +11,6 @@ from app.core.config import settings
 from app.db.database import engine, Base, SessionLocal
 from app.models.models import User
 from app.core.security import get_password_hash, verify_password
-from app.api.v1 import auth, users, quizzes, attempts, subjects, question_bank, analytics
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +25,34 @@ def ensure_user_profile_image_column() -> None:
     with engine.begin() as connection:
         connection.execute(text("ALTER TABLE users ADD COLUMN profile_image TEXT"))
 
+def warm_connection_pool() -> None:
+    """Pre-open pooled connections so the first requests skip the connect handshake."""
+    pool_size = getattr(engine.pool, "size", lambda: 0)()
+    if pool_size <= 0:
+        return
+
+    def _warm(_):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+        list(executor.map(_warm, range(pool_size)))
+
+
+def _admin_insert_stmt(values: dict):
+    """Build a dialect-aware INSERT that silently skips an existing admin row."""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+        return pg_insert(User.__table__).values(**values).on_conflict_do_nothing(index_elements=["email"])
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        return sqlite_insert(User.__table__).values(**values).on_conflict_do_nothing(index_elements=["email"])
+    # Other dialects fall back to a plain INSERT; callers handle IntegrityError.
+    return User.__table__.insert().values(**values)
+
+
 def init_admin() -> None:
     """Create the initial admin user if it doesn't exist.
 
@@ -50,35 +79,75 @@ def init_admin() -> None:
                 print("ℹ️  Admin user already exists")
             return
 
-        admin_user = User(
-            email=admin_email,
-            hashed_password=get_password_hash(admin_password),
-            first_name="Admin",
-            last_name="User",
-            role="admin",
-            is_active=True,
+        # Single round-trip, race-free against concurrent startup instances:
+        # ON CONFLICT DO NOTHING instead of SELECT-then-INSERT.
+        insert_stmt = _admin_insert_stmt(
+            {
+                "email": admin_email,
+                "hashed_password": get_password_hash(admin_password),
+                "first_name": "Admin",
+                "last_name": "User",
+                "role": "admin",
+                "is_active": True,
+            }
         )
-        db.add(admin_user)
         try:
+            result = db.execute(insert_stmt)
             db.commit()
-            print(f"✅ Admin user created: {admin_email}")
+            if int(result.rowcount or 0) > 0:
+                print(f"✅ Admin user created: {admin_email}")
+            else:
+                print("ℹ️  Admin user already exists (created concurrently)")
         except IntegrityError:
-            # Another startup instance may create admin concurrently; ignore duplicate.
+            # Plain-INSERT dialects may still race; ignore duplicate.
             db.rollback()
             print("ℹ️  Admin user already exists (detected during commit)")
     finally:
         db.close()
 
 
+def _startup_bootstrap() -> None:
+    """Blocking startup work, run off the event loop.
+
+    init_admin() can spend hundreds of milliseconds in bcrypt; keeping it
+    (and the DDL round-trips) in a worker thread leaves the loop free.
+    """
+    Base.metadata.create_all(bind=engine)
+    ensure_user_profile_image_column()
+    init_admin()
+    warm_connection_pool()
+
+
+def _attach_routers(app: FastAPI) -> None:
+    """Import and mount the API routers.
+
+    Runs at module scope: serverless hosts (the Vercel entry point) and
+    TestClient used without a context manager never drive ASGI lifespan
+    startup, so the routes must exist as soon as the app is importable.
+    Only the DB bootstrap is deferred to lifespan.
+    """
+    if getattr(app.state, "routers_attached", False):
+        return
+
+    from app.api.v1 import auth, users, quizzes, attempts, subjects, question_bank, analytics
+
+    app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
+    app.include_router(users.router, prefix="/api/v1/users", tags=["Users"])
+    app.include_router(subjects.router, prefix="/api/v1/subjects", tags=["Subjects"])
+    app.include_router(question_bank.router, prefix="/api/v1/question-bank", tags=["Question Bank"])
+    app.include_router(quizzes.router, prefix="/api/v1/quizzes", tags=["Quizzes"])
+    app.include_router(attempts.router, prefix="/api/v1/attempts", tags=["Quiz Attempts"])
+    app.include_router(analytics.router, prefix="/api/v1/analytics", tags=["Analytics & Reports"])
+    app.state.routers_attached = True
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     app.state.db_startup_ok = True
     app.state.db_startup_error = None
     try:
-        Base.metadata.create_all(bind=engine)
-        ensure_user_profile_image_column()
-        init_admin()
+        await asyncio.to_thread(_startup_bootstrap)
     except Exception as error:
         app.state.db_startup_ok = False
         app.state.db_startup_error = str(error)
@@ -95,6 +164,8 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+_attach_routers(app)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -121,15 +192,6 @@ async def add_security_headers(request, call_next):
     )
     return response
 
-# Include routers
-app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
-app.include_router(users.router, prefix="/api/v1/users", tags=["Users"])
-app.include_router(subjects.router, prefix="/api/v1/subjects", tags=["Subjects"])
-app.include_router(question_bank.router, prefix="/api/v1/question-bank", tags=["Question Bank"])
-app.include_router(quizzes.router, prefix="/api/v1/quizzes", tags=["Quizzes"])
-app.include_router(attempts.router, prefix="/api/v1/attempts", tags=["Quiz Attempts"])
-app.include_router(analytics.router, prefix="/api/v1/analytics", tags=["Analytics & Reports"])
-
 @app.get("/")
 async def root():
     return {
@@ -12,13 +12,21 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from app.db.database import engine, Base
 from app.models.models import User, Quiz, Question, QuizAttempt
 from app.core.security import get_password_hash
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
 
 def upgrade_database():
     """Create any missing tables/columns represented by current ORM metadata."""
     print("🔄 Applying safe schema upgrade (non-destructive)...")
     print("✨ Creating missing tables if needed...")
-    Base.metadata.create_all(bind=engine)
+    # Reflect the table list in one round-trip and create only what is
+    # missing, instead of letting create_all probe existence per table.
+    existing_tables = set(inspect(engine).get_table_names())
+    missing_tables = [
+        table for name, table in Base.metadata.tables.items() if name not in existing_tables
+    ]
+    if missing_tables:
+        Base.metadata.create_all(bind=engine, tables=missing_tables, checkfirst=False)
     print("✅ Safe upgrade completed (existing data preserved)")
 
 
@@ -30,44 +38,51 @@ def reset_database():
     print("📦 Dropping existing tables...")
     Base.metadata.drop_all(bind=engine)
 
-    # Create all tables with new schema
+    # Create all tables with new schema; the database is empty after
+    # drop_all, so skip the per-table existence reflection.
     print("✨ Creating tables with updated schema...")
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=engine, checkfirst=False)
 
     print("✅ Database schema reset successfully!")
 
 def create_admin_user():
     """Create default admin user"""
     print("\n👤 Creating default admin user...")
-    
+
     from app.db.database import SessionLocal
     db = SessionLocal()
-    
+
     try:
-        # Check if admin exists
-        existing_admin = db.query(User).filter(User.email == "admin@macquiz.com").first()
-        if existing_admin:
-            print("ℹ️  Admin user already exists")
-            return
-        
-        # Create admin user
-        admin = User(
-            email="admin@macquiz.com",
-            hashed_password=get_password_hash("admin123"),
-            first_name="Admin",
-            last_name="User",
-            role="admin",
-            is_active=True,
-            phone_number=None  # Optional field
-        )
-        
-        db.add(admin)
+        # Single INSERT that skips silently when the admin already exists:
+        # one round-trip, no SELECT-then-INSERT race window.
+        values = {
+            "email": "admin@macquiz.com",
+            "hashed_password": get_password_hash("admin123"),
+            "first_name": "Admin",
+            "last_name": "User",
+            "role": "admin",
+            "is_active": True,
+            "phone_number": None,  # Optional field
+        }
+        if engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as pg_insert
+            stmt = pg_insert(User.__table__).values(**values).on_conflict_do_nothing(index_elements=["email"])
+        elif engine.dialect.name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+            stmt = sqlite_insert(User.__table__).values(**values).on_conflict_do_nothing(index_elements=["email"])
+        else:
+            stmt = User.__table__.insert().values(**values)
+
+        result = db.execute(stmt)
         db.commit()
-        
-        print("✅ Admin user created successfully!")
-        print("📧 Email: admin@macquiz.com")
-        print("🔑 Password: admin123")
-        
+
+        if int(result.rowcount or 0) > 0:
+            print("✅ Admin user created successfully!")
+            print("📧 Email: admin@macquiz.com")
+            print("🔑 Password: admin123")
+        else:
+            print("ℹ️  Admin user already exists")
+
     except Exception as e:
         print(f"❌ Error creating admin user: {e}")
         db.rollback()
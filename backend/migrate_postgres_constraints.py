@@ -5,32 +5,65 @@ Features:
 - Duplicate pre-checks for target unique constraints
 - Dry-run mode by default
 - Optional auto-fix mode with deterministic keep/delete rules
-- Optional pg_dump backup before destructive dedupe
+- Optional per-table COPY backup before destructive dedupe
 """
 
 import argparse
-import os
-import subprocess
-from dataclasses import dataclass
+import logging
+import logging.handlers
+from collections import namedtuple
+from dataclasses import dataclass, field
 
 from sqlalchemy import text
-from sqlalchemy.engine import make_url
+from sqlalchemy.sql.elements import TextClause
 
 from app.db.database import engine
 
+# Buffered logging: status lines accumulate in memory and flush in batches
+# (or at exit) instead of costing one stdout syscall per line.
+logger = logging.getLogger("macquiz.migrate")
+_log_handler = logging.handlers.MemoryHandler(capacity=200, target=logging.StreamHandler())
+logger.addHandler(_log_handler)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
 
 @dataclass
 class ConstraintCheck:
     name: str
+    duplicate_exists_sql: str
     duplicate_count_sql: str
     create_sql: str
     description: str
+    # Compiled once at import; the exists/count SQL stays as strings because
+    # the precheck inlines them into combined single-round-trip SELECTs.
+    create_stmt: TextClause = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.create_stmt = text(self.create_sql)
+
+
+# Index DDL carried with its TextClause precompiled at import, so repeated
+# runs execute cached statements instead of re-parsing SQL strings.
+IndexDDL = namedtuple("IndexDDL", ["name", "stmt"])
+
+
+def _index_ddl(name: str, create_sql: str) -> IndexDDL:
+    return IndexDDL(name, text(create_sql))
 
 
 UNIQUE_CHECKS = [
     ConstraintCheck(
         name="uq_answers_attempt_question",
         description="One answer per question in each attempt",
+        duplicate_exists_sql="""
+            SELECT EXISTS (
+                SELECT 1
+                FROM public.answers
+                GROUP BY attempt_id, question_id
+                HAVING COUNT(*) > 1
+            )
+        """,
         duplicate_count_sql="""
             SELECT COUNT(*)
             FROM (
@@ -41,13 +74,21 @@ UNIQUE_CHECKS = [
             ) d
         """,
         create_sql="""
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_answers_attempt_question
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_answers_attempt_question
             ON public.answers (attempt_id, question_id)
         """,
     ),
     ConstraintCheck(
         name="uq_quiz_assignments_quiz_student",
         description="One assignment per student per quiz",
+        duplicate_exists_sql="""
+            SELECT EXISTS (
+                SELECT 1
+                FROM public.quiz_assignments
+                GROUP BY quiz_id, student_id
+                HAVING COUNT(*) > 1
+            )
+        """,
         duplicate_count_sql="""
             SELECT COUNT(*)
             FROM (
@@ -58,13 +99,21 @@ UNIQUE_CHECKS = [
             ) d
         """,
         create_sql="""
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_quiz_assignments_quiz_student
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_quiz_assignments_quiz_student
             ON public.quiz_assignments (quiz_id, student_id)
         """,
     ),
     ConstraintCheck(
         name="uq_revoked_tokens_jti",
         description="JWT jti must be globally unique",
+        duplicate_exists_sql="""
+            SELECT EXISTS (
+                SELECT 1
+                FROM public.revoked_tokens
+                GROUP BY jti
+                HAVING COUNT(*) > 1
+            )
+        """,
         duplicate_count_sql="""
             SELECT COUNT(*)
             FROM (
@@ -75,13 +124,21 @@ UNIQUE_CHECKS = [
             ) d
         """,
         create_sql="""
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_revoked_tokens_jti
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_revoked_tokens_jti
             ON public.revoked_tokens (jti)
         """,
     ),
     ConstraintCheck(
         name="uq_user_token_blocks_user_id",
         description="Single token-block row per user",
+        duplicate_exists_sql="""
+            SELECT EXISTS (
+                SELECT 1
+                FROM public.user_token_blocks
+                GROUP BY user_id
+                HAVING COUNT(*) > 1
+            )
+        """,
         duplicate_count_sql="""
             SELECT COUNT(*)
             FROM (
@@ -92,13 +149,21 @@ UNIQUE_CHECKS = [
             ) d
         """,
         create_sql="""
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_user_token_blocks_user_id
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_user_token_blocks_user_id
             ON public.user_token_blocks (user_id)
         """,
     ),
     ConstraintCheck(
         name="uq_users_email",
         description="Email must be unique",
+        duplicate_exists_sql="""
+            SELECT EXISTS (
+                SELECT 1
+                FROM public.users
+                GROUP BY email
+                HAVING COUNT(*) > 1
+            )
+        """,
         duplicate_count_sql="""
             SELECT COUNT(*)
             FROM (
@@ -109,13 +174,22 @@ UNIQUE_CHECKS = [
             ) d
         """,
         create_sql="""
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_users_email
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_users_email
             ON public.users (email)
         """,
     ),
     ConstraintCheck(
         name="uq_users_student_id",
         description="Student/teacher user ID must be unique when present",
+        duplicate_exists_sql="""
+            SELECT EXISTS (
+                SELECT 1
+                FROM public.users
+                WHERE student_id IS NOT NULL
+                GROUP BY student_id
+                HAVING COUNT(*) > 1
+            )
+        """,
         duplicate_count_sql="""
             SELECT COUNT(*)
             FROM (
@@ -127,307 +201,545 @@ UNIQUE_CHECKS = [
             ) d
         """,
         create_sql="""
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_users_student_id
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_users_student_id
             ON public.users (student_id)
             WHERE student_id IS NOT NULL
         """,
     ),
 ]
 
+# Composite indexes matching each dedupe's PARTITION BY / ORDER BY, created
+# before auto-fix so the ROW_NUMBER() window reads an index scan instead of
+# re-sorting the whole table for every dedupe pass.
+DEDUPE_SUPPORT_INDEXES = [
+    _index_ddl(
+        "ix_answers_attempt_question_id",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_answers_attempt_question_id ON public.answers (attempt_id, question_id, id DESC)",
+    ),
+    _index_ddl(
+        "ix_quiz_assignments_quiz_student_id",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_quiz_assignments_quiz_student_id ON public.quiz_assignments (quiz_id, student_id, id DESC)",
+    ),
+    _index_ddl(
+        "ix_revoked_tokens_jti_id",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_revoked_tokens_jti_id ON public.revoked_tokens (jti, id DESC)",
+    ),
+    _index_ddl(
+        "ix_user_token_blocks_user_id_id",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_token_blocks_user_id_id ON public.user_token_blocks (user_id, id DESC)",
+    ),
+]
+
+# Ids streamed/deleted per dedupe chunk. Each chunk runs in its own short
+# transaction so locks are released and memory reclaimed between chunks.
+DEDUPE_BATCH_SIZE = 10_000
+
 NON_UNIQUE_INDEXES = [
-    (
+    _index_ddl(
         "ix_answers_attempt_id",
-        "CREATE INDEX IF NOT EXISTS ix_answers_attempt_id ON public.answers (attempt_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_answers_attempt_id ON public.answers (attempt_id)",
     ),
-    (
+    _index_ddl(
         "ix_answers_question_id",
-        "CREATE INDEX IF NOT EXISTS ix_answers_question_id ON public.answers (question_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_answers_question_id ON public.answers (question_id)",
     ),
-    (
+    _index_ddl(
         "ix_question_bank_subject_id",
-        "CREATE INDEX IF NOT EXISTS ix_question_bank_subject_id ON public.question_bank (subject_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_question_bank_subject_id ON public.question_bank (subject_id)",
     ),
-    (
+    _index_ddl(
         "ix_question_bank_creator_id",
-        "CREATE INDEX IF NOT EXISTS ix_question_bank_creator_id ON public.question_bank (creator_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_question_bank_creator_id ON public.question_bank (creator_id)",
     ),
-    (
+    _index_ddl(
         "ix_questions_quiz_id",
-        "CREATE INDEX IF NOT EXISTS ix_questions_quiz_id ON public.questions (quiz_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_quiz_id ON public.questions (quiz_id)",
     ),
-    (
+    _index_ddl(
         "ix_questions_question_bank_id",
-        "CREATE INDEX IF NOT EXISTS ix_questions_question_bank_id ON public.questions (question_bank_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_question_bank_id ON public.questions (question_bank_id)",
     ),
-    (
+    _index_ddl(
         "ix_quiz_attempts_quiz_id",
-        "CREATE INDEX IF NOT EXISTS ix_quiz_attempts_quiz_id ON public.quiz_attempts (quiz_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_quiz_attempts_quiz_id ON public.quiz_attempts (quiz_id)",
     ),
-    (
+    _index_ddl(
         "ix_quiz_attempts_student_id",
-        "CREATE INDEX IF NOT EXISTS ix_quiz_attempts_student_id ON public.quiz_attempts (student_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_quiz_attempts_student_id ON public.quiz_attempts (student_id)",
     ),
-    (
+    _index_ddl(
         "ix_quizzes_creator_id",
-        "CREATE INDEX IF NOT EXISTS ix_quizzes_creator_id ON public.quizzes (creator_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_quizzes_creator_id ON public.quizzes (creator_id)",
     ),
-    (
+    _index_ddl(
         "ix_quizzes_subject_id",
-        "CREATE INDEX IF NOT EXISTS ix_quizzes_subject_id ON public.quizzes (subject_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_quizzes_subject_id ON public.quizzes (subject_id)",
     ),
-    (
+    _index_ddl(
         "ix_subjects_creator_id",
-        "CREATE INDEX IF NOT EXISTS ix_subjects_creator_id ON public.subjects (creator_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_subjects_creator_id ON public.subjects (creator_id)",
     ),
 ]
 
 
-def _scalar(connection, sql: str) -> int:
-    result = connection.execute(text(sql)).scalar()
-    return int(result or 0)
+# All pre-checks batched into one statement so the server sees a single
+# round-trip and one combined plan instead of one query per table. EXISTS
+# lets PostgreSQL stop at the first duplicate group rather than counting
+# them all; exact counts are fetched lazily for blocked checks only.
+PRECHECK_STMT = text(
+    "\nUNION ALL\n".join(
+        f"SELECT '{check.name}' AS name, ({check.duplicate_exists_sql}) AS has_duplicates"
+        for check in UNIQUE_CHECKS
+    )
+)
+
+
+def _count_duplicate_groups(connection, flagged) -> list:
+    # All flagged counts as scalar subqueries of one SELECT: a single
+    # round-trip returning one row, regardless of how many checks are
+    # blocked.
+    combined_sql = "SELECT " + ", ".join(
+        f"({check.duplicate_count_sql}) AS c{position}"
+        for position, check in enumerate(flagged)
+    )
+    row = connection.execute(text(combined_sql)).one()
+    return [int(value or 0) for value in row]
 
 
 def _load_precheck(connection):
-    blocked = []
-    ready = []
+    rows = connection.execute(PRECHECK_STMT)
+    has_duplicates_by_name = {row.name: bool(row.has_duplicates) for row in rows}
 
-    for check in UNIQUE_CHECKS:
-        duplicate_groups = _scalar(connection, check.duplicate_count_sql)
-        if duplicate_groups > 0:
-            blocked.append((check, duplicate_groups))
-        else:
-            ready.append(check)
+    flagged = [check for check in UNIQUE_CHECKS if has_duplicates_by_name[check.name]]
+    ready = [check for check in UNIQUE_CHECKS if not has_duplicates_by_name[check.name]]
+
+    if not flagged:
+        return [], ready
 
-    return blocked, ready
+    counts = _count_duplicate_groups(connection, flagged)
+    return list(zip(flagged, counts)), ready
 
 
-def _merge_users_by_key(connection, key_column: str, include_not_null_filter: bool) -> int:
+def _build_merge_statements(key_column: str, include_not_null_filter: bool):
     where_clause = f"{key_column} IS NOT NULL" if include_not_null_filter else "TRUE"
-    merge_cte = f"""
+    remap_table = f"tmp_remap_{key_column}"
+
+    # Stage the old_id -> keep_id mapping in a temp table and ANALYZE it so
+    # the planner has row estimates for the FK-rewrite joins. The users
+    # window scan runs exactly once, when the staging table is built.
+    create_stmt = text(f"""
+        CREATE TEMP TABLE {remap_table} ON COMMIT DROP AS
         WITH dup_map AS (
             SELECT id AS old_id,
                    MIN(id) OVER (PARTITION BY {key_column}) AS keep_id
             FROM public.users
             WHERE {where_clause}
+        )
+        SELECT old_id, keep_id
+        FROM dup_map
+        WHERE old_id <> keep_id
+    """)
+    index_stmt = text(f"CREATE INDEX ON {remap_table} (old_id)")
+    analyze_stmt = text(f"ANALYZE {remap_table}")
+
+    # One statement with writable CTEs: six FK rewrites plus the delete in
+    # a single round-trip, all joining the pre-built staging table.
+    merge_stmt = text(f"""
+        WITH pairs AS (
+            SELECT old_id, keep_id FROM {remap_table}
         ),
-        pairs AS (
-            SELECT old_id, keep_id
-            FROM dup_map
-            WHERE old_id <> keep_id
+        upd_quizzes AS (
+            UPDATE public.quizzes q SET creator_id = p.keep_id
+            FROM pairs p WHERE q.creator_id = p.old_id
+            RETURNING 1
+        ),
+        upd_subjects AS (
+            UPDATE public.subjects s SET creator_id = p.keep_id
+            FROM pairs p WHERE s.creator_id = p.old_id
+            RETURNING 1
+        ),
+        upd_question_bank AS (
+            UPDATE public.question_bank qb SET creator_id = p.keep_id
+            FROM pairs p WHERE qb.creator_id = p.old_id
+            RETURNING 1
+        ),
+        upd_quiz_attempts AS (
+            UPDATE public.quiz_attempts qa SET student_id = p.keep_id
+            FROM pairs p WHERE qa.student_id = p.old_id
+            RETURNING 1
+        ),
+        upd_quiz_assignments AS (
+            UPDATE public.quiz_assignments qa SET student_id = p.keep_id
+            FROM pairs p WHERE qa.student_id = p.old_id
+            RETURNING 1
+        ),
+        upd_token_blocks AS (
+            UPDATE public.user_token_blocks ub SET user_id = p.keep_id
+            FROM pairs p WHERE ub.user_id = p.old_id
+            RETURNING 1
         )
-    """
+        DELETE FROM public.users u USING pairs p WHERE u.id = p.old_id
+    """)
+
+    return create_stmt, index_stmt, analyze_stmt, merge_stmt
+
 
-    connection.execute(text(merge_cte + "UPDATE public.quizzes q SET creator_id = p.keep_id FROM pairs p WHERE q.creator_id = p.old_id"))
-    connection.execute(text(merge_cte + "UPDATE public.subjects s SET creator_id = p.keep_id FROM pairs p WHERE s.creator_id = p.old_id"))
-    connection.execute(text(merge_cte + "UPDATE public.question_bank qb SET creator_id = p.keep_id FROM pairs p WHERE qb.creator_id = p.old_id"))
-    connection.execute(text(merge_cte + "UPDATE public.quiz_attempts qa SET student_id = p.keep_id FROM pairs p WHERE qa.student_id = p.old_id"))
-    connection.execute(text(merge_cte + "UPDATE public.quiz_assignments qa SET student_id = p.keep_id FROM pairs p WHERE qa.student_id = p.old_id"))
-    connection.execute(text(merge_cte + "UPDATE public.user_token_blocks ub SET user_id = p.keep_id FROM pairs p WHERE ub.user_id = p.old_id"))
+# Prebuilt per merge key, so repeated runs reuse the same compiled
+# statements instead of re-concatenating and re-parsing the SQL.
+_MERGE_USER_STMTS = {
+    "email": _build_merge_statements("email", include_not_null_filter=False),
+    "student_id": _build_merge_statements("student_id", include_not_null_filter=True),
+}
 
-    delete_sql = merge_cte + "DELETE FROM public.users u USING pairs p WHERE u.id = p.old_id"
-    deleted = connection.execute(text(delete_sql))
+
+def _merge_users_by_key(connection, key_column: str) -> int:
+    create_stmt, index_stmt, analyze_stmt, merge_stmt = _MERGE_USER_STMTS[key_column]
+    connection.execute(create_stmt)
+    connection.execute(index_stmt)
+    connection.execute(analyze_stmt)
+    deleted = connection.execute(merge_stmt)
     return int(deleted.rowcount or 0)
 
 
-def _dedupe_answers(connection) -> int:
-    sql = """
-        WITH ranked AS (
-            SELECT id,
-                   ROW_NUMBER() OVER (
-                       PARTITION BY attempt_id, question_id
-                       ORDER BY id DESC
-                   ) AS rn
-            FROM public.answers
-        )
-        DELETE FROM public.answers a
-        USING ranked r
-        WHERE a.id = r.id
-          AND r.rn > 1
-    """
-    result = connection.execute(text(sql))
-    return int(result.rowcount or 0)
-
-
-def _dedupe_quiz_assignments(connection) -> int:
-    sql = """
-        WITH ranked AS (
-            SELECT id,
-                   ROW_NUMBER() OVER (
-                       PARTITION BY quiz_id, student_id
-                       ORDER BY assigned_at DESC NULLS LAST, id DESC
-                   ) AS rn
-            FROM public.quiz_assignments
-        )
-        DELETE FROM public.quiz_assignments qa
-        USING ranked r
-        WHERE qa.id = r.id
-          AND r.rn > 1
-    """
-    result = connection.execute(text(sql))
-    return int(result.rowcount or 0)
-
-
-def _dedupe_revoked_tokens(connection) -> int:
-    sql = """
-        WITH ranked AS (
-            SELECT id,
-                   ROW_NUMBER() OVER (
-                       PARTITION BY jti
-                       ORDER BY revoked_at DESC NULLS LAST, id DESC
-                   ) AS rn
-            FROM public.revoked_tokens
-        )
-        DELETE FROM public.revoked_tokens rt
-        USING ranked r
-        WHERE rt.id = r.id
-          AND r.rn > 1
-    """
-    result = connection.execute(text(sql))
-    return int(result.rowcount or 0)
-
-
-def _dedupe_user_token_blocks(connection) -> int:
-    sql = """
-        WITH ranked AS (
-            SELECT id,
-                   ROW_NUMBER() OVER (
-                       PARTITION BY user_id
-                       ORDER BY revoked_before DESC NULLS LAST, id DESC
-                   ) AS rn
-            FROM public.user_token_blocks
-        )
-        DELETE FROM public.user_token_blocks ub
-        USING ranked r
-        WHERE ub.id = r.id
-          AND r.rn > 1
+def _dedupe_in_chunks(doomed_stmt, delete_stmt) -> int:
+    """Stream doomed row ids and delete them in bounded batches.
+
+    The ranked scan runs once, streamed over a server-side cursor
+    (stream_results) instead of being materialized in work_mem; deletes
+    go out as id = ANY(...) batches, each in its own short transaction so
+    locks are released and vacuum can reclaim space between chunks.
     """
-    result = connection.execute(text(sql))
-    return int(result.rowcount or 0)
-
-
-def _run_auto_fix(connection):
-    print("\n🧹 Running deterministic auto-fix for duplicate rows...")
-    deleted_email_users = _merge_users_by_key(connection, "email", include_not_null_filter=False)
-    if deleted_email_users > 0:
-        print(f"  ✅ Merged users by email: removed {deleted_email_users} duplicate user rows")
-
-    deleted_student_users = _merge_users_by_key(connection, "student_id", include_not_null_filter=True)
-    if deleted_student_users > 0:
-        print(f"  ✅ Merged users by student_id: removed {deleted_student_users} duplicate user rows")
-
-    deleted_answers = _dedupe_answers(connection)
-    deleted_assignments = _dedupe_quiz_assignments(connection)
-    deleted_tokens = _dedupe_revoked_tokens(connection)
-    deleted_blocks = _dedupe_user_token_blocks(connection)
-
-    print(f"  ✅ Deduped answers: removed {deleted_answers} rows")
-    print(f"  ✅ Deduped quiz_assignments: removed {deleted_assignments} rows")
-    print(f"  ✅ Deduped revoked_tokens: removed {deleted_tokens} rows")
-    print(f"  ✅ Deduped user_token_blocks: removed {deleted_blocks} rows")
-
-
-def _build_pg_dump_command(backup_file: str):
-    url = make_url(str(engine.url))
-    cmd = [
-        "pg_dump",
-        "-h",
-        url.host or "localhost",
-        "-p",
-        str(url.port or 5432),
-        "-U",
-        url.username or "postgres",
-        "-d",
-        (url.database or "postgres").lstrip("/"),
-        "-Fc",
-        "-f",
-        backup_file,
-    ]
-
-    env = os.environ.copy()
-    if url.password:
-        env["PGPASSWORD"] = url.password
-
-    return cmd, env
+    total_deleted = 0
+    with engine.connect().execution_options(
+        stream_results=True, yield_per=DEDUPE_BATCH_SIZE
+    ) as read_connection:
+        result = read_connection.execute(doomed_stmt)
+        for id_chunk in result.partitions(DEDUPE_BATCH_SIZE):
+            ids = [row.id for row in id_chunk]
+            with engine.begin() as write_connection:
+                deleted = write_connection.execute(delete_stmt, {"ids": ids}).rowcount
+            total_deleted += int(deleted or 0)
+    return total_deleted
+
+
+# Compiled once at import; every chunk reuses the same statement objects.
+_DOOMED_ANSWERS_STMT = text("""
+    SELECT id FROM (
+        SELECT id,
+               ROW_NUMBER() OVER (
+                   PARTITION BY attempt_id, question_id
+                   ORDER BY id DESC
+               ) AS rn
+        FROM public.answers
+    ) ranked
+    WHERE rn > 1
+""")
+
+_DELETE_ANSWERS_STMT = text("DELETE FROM public.answers WHERE id = ANY(:ids)")
+
+_DOOMED_QUIZ_ASSIGNMENTS_STMT = text("""
+    SELECT id FROM (
+        SELECT id,
+               ROW_NUMBER() OVER (
+                   PARTITION BY quiz_id, student_id
+                   ORDER BY assigned_at DESC NULLS LAST, id DESC
+               ) AS rn
+        FROM public.quiz_assignments
+    ) ranked
+    WHERE rn > 1
+""")
+
+_DELETE_QUIZ_ASSIGNMENTS_STMT = text("DELETE FROM public.quiz_assignments WHERE id = ANY(:ids)")
+
+_DOOMED_REVOKED_TOKENS_STMT = text("""
+    SELECT id FROM (
+        SELECT id,
+               ROW_NUMBER() OVER (
+                   PARTITION BY jti
+                   ORDER BY revoked_at DESC NULLS LAST, id DESC
+               ) AS rn
+        FROM public.revoked_tokens
+    ) ranked
+    WHERE rn > 1
+""")
+
+_DELETE_REVOKED_TOKENS_STMT = text("DELETE FROM public.revoked_tokens WHERE id = ANY(:ids)")
+
+_DOOMED_USER_TOKEN_BLOCKS_STMT = text("""
+    SELECT id FROM (
+        SELECT id,
+               ROW_NUMBER() OVER (
+                   PARTITION BY user_id
+                   ORDER BY revoked_before DESC NULLS LAST, id DESC
+               ) AS rn
+        FROM public.user_token_blocks
+    ) ranked
+    WHERE rn > 1
+""")
+
+_DELETE_USER_TOKEN_BLOCKS_STMT = text("DELETE FROM public.user_token_blocks WHERE id = ANY(:ids)")
+
+
+def _dedupe_answers() -> int:
+    return _dedupe_in_chunks(_DOOMED_ANSWERS_STMT, _DELETE_ANSWERS_STMT)
+
+
+def _dedupe_quiz_assignments() -> int:
+    return _dedupe_in_chunks(_DOOMED_QUIZ_ASSIGNMENTS_STMT, _DELETE_QUIZ_ASSIGNMENTS_STMT)
+
+
+def _dedupe_revoked_tokens() -> int:
+    return _dedupe_in_chunks(_DOOMED_REVOKED_TOKENS_STMT, _DELETE_REVOKED_TOKENS_STMT)
+
+
+def _dedupe_user_token_blocks() -> int:
+    return _dedupe_in_chunks(_DOOMED_USER_TOKEN_BLOCKS_STMT, _DELETE_USER_TOKEN_BLOCKS_STMT)
+
+
+def _merge_users_step(key_column: str) -> None:
+    with engine.begin() as connection:
+        deleted = _merge_users_by_key(connection, key_column)
+    if deleted > 0:
+        logger.info(f"  ✅ Merged users by {key_column}: removed {deleted} duplicate user rows")
+
+
+def _dedupe_table_step(label: str, dedupe) -> None:
+    deleted = dedupe()
+    logger.info(f"  ✅ Deduped {label}: removed {deleted} rows")
+
+
+# Each auto-fix step is idempotent and runs in its own short transaction(s),
+# so individual steps can be re-run from the CLI against a live database
+# without holding one giant transaction across the whole fix.
+DEDUPE_STEPS = {
+    "users-email": lambda: _merge_users_step("email"),
+    "users-student-id": lambda: _merge_users_step("student_id"),
+    "answers": lambda: _dedupe_table_step("answers", _dedupe_answers),
+    "quiz-assignments": lambda: _dedupe_table_step("quiz_assignments", _dedupe_quiz_assignments),
+    "revoked-tokens": lambda: _dedupe_table_step("revoked_tokens", _dedupe_revoked_tokens),
+    "user-token-blocks": lambda: _dedupe_table_step("user_token_blocks", _dedupe_user_token_blocks),
+}
+
+
+def _run_auto_fix(only=None):
+    logger.info("\n🧹 Running deterministic auto-fix for duplicate rows...")
+    for step_name, step in DEDUPE_STEPS.items():
+        if only and step_name not in only:
+            continue
+        step()
+
+
+# Only the tables the auto-fix may mutate need a backup.
+BACKUP_TABLES = [
+    "users",
+    "answers",
+    "quiz_assignments",
+    "revoked_tokens",
+    "user_token_blocks",
+]
 
 
 def _maybe_run_backup(backup_file: str) -> bool:
-    print(f"\n💾 Creating backup via pg_dump: {backup_file}")
-    cmd, env = _build_pg_dump_command(backup_file)
+    """Export auto-fix target tables via COPY ... TO STDOUT.
+
+    Streams one binary COPY file per table over the existing database
+    connection, so no pg_dump binary is needed and untouched tables are
+    not serialized.
+    """
+    logger.info(f"\n💾 Backing up auto-fix target tables via COPY: {backup_file}.<table>.copy")
+    raw_connection = engine.raw_connection()
     try:
-        subprocess.run(cmd, env=env, check=True)
-        print("✅ Backup created successfully")
+        # psycopg 3 streaming COPY: cursor.copy() yields raw buffers.
+        cursor = raw_connection.cursor()
+        for table in BACKUP_TABLES:
+            table_file = f"{backup_file}.{table}.copy"
+            with open(table_file, "wb") as handle:
+                with cursor.copy(
+                    f"COPY (SELECT * FROM public.{table}) TO STDOUT (FORMAT BINARY)"
+                ) as copy:
+                    for data in copy:
+                        handle.write(data)
+            logger.info(f"  ✅ Backed up public.{table} -> {table_file}")
+        logger.info("✅ Backup created successfully")
         return True
-    except FileNotFoundError:
-        print("❌ pg_dump not found in PATH. Install PostgreSQL client tools or run without --backup-file")
-    except subprocess.CalledProcessError as error:
-        print(f"❌ pg_dump failed with exit code {error.returncode}")
-    return False
+    except Exception as error:
+        # Include the exception type: a driver/API error must not read
+        # like a database-side failure.
+        logger.info(f"❌ COPY backup failed: {error!r}")
+        return False
+    finally:
+        raw_connection.close()
 
 
-def run(apply_changes: bool, auto_fix: bool, backup_file: str | None) -> int:
+def _require_postgres() -> bool:
     if engine.dialect.name != "postgresql":
-        print(f"❌ This script is for PostgreSQL only. Current dialect: {engine.dialect.name}")
+        logger.info(f"❌ This script is for PostgreSQL only. Current dialect: {engine.dialect.name}")
+        return False
+    return True
+
+
+def _print_precheck_report(blocked) -> None:
+    if blocked:
+        logger.info("\n⚠️  Duplicate data detected. These unique indexes are blocked:")
+        for check, count in blocked:
+            logger.info(f"  - {check.name}: {count} duplicate group(s) found ({check.description})")
+    else:
+        logger.info("\n✅ No duplicate groups found for targeted unique constraints")
+
+    logger.info("\n📋 Planned unique indexes:")
+    for check in UNIQUE_CHECKS:
+        status = "BLOCKED" if any(item[0].name == check.name for item in blocked) else "READY"
+        logger.info(f"  - {check.name}: {status}")
+
+
+def _validate_concurrent_indexes(index_names) -> list:
+    """Return names of indexes left INVALID by failed CONCURRENTLY builds."""
+    if not index_names:
+        return []
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text("""
+                SELECT c.relname
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = ANY(:names)
+                  AND NOT i.indisvalid
+            """),
+            {"names": list(index_names)},
+        )
+        return [row.relname for row in rows]
+
+
+def _strip_concurrently(create_sql: str) -> str:
+    return create_sql.replace("INDEX CONCURRENTLY ", "INDEX ")
+
+
+def _ensure_indexes_batched(label: str, index_ddls) -> None:
+    """Create all indexes in one multi-statement execute: a single round trip.
+
+    psycopg accepts several semicolon-separated statements in one protocol
+    message, so the whole list costs one RTT instead of one per index. The
+    batch runs in a normal transaction, so CONCURRENTLY is stripped and
+    each build takes a full table lock. That trade is only sensible for a
+    fresh or offline database, which is why this path sits behind
+    --no-concurrently rather than being the default.
+    """
+    logger.info(f"\n🧱 Ensuring {label} indexes (single batch, non-concurrent)...")
+    joined = ";\n".join(_strip_concurrently(index.stmt.text) for index in index_ddls)
+    try:
+        with engine.begin() as connection:
+            connection.exec_driver_sql(joined)
+    except Exception as error:
+        # Re-run one statement at a time to pinpoint the failing DDL.
+        logger.info(f"  ⚠️  Batched index creation failed ({error}); retrying per statement")
+        with engine.begin() as connection:
+            for index in index_ddls:
+                connection.exec_driver_sql(_strip_concurrently(index.stmt.text))
+                logger.info(f"  ✅ Ensured {index.name}")
+        return
+    for index in index_ddls:
+        logger.info(f"  ✅ Ensured {index.name}")
+
+
+def _ensure_indexes(label: str, index_ddls, concurrently: bool = True) -> None:
+    if not index_ddls:
+        return
+    if not concurrently:
+        _ensure_indexes_batched(label, index_ddls)
+        return
+
+    logger.info(f"\n🧱 Ensuring {label} indexes...")
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for index in index_ddls:
+            connection.execute(index.stmt)
+            logger.info(f"  ✅ Ensured {index.name}")
+
+    # An interrupted CONCURRENTLY build leaves the index behind marked
+    # INVALID; surface those so they can be dropped and rebuilt.
+    for index_name in _validate_concurrent_indexes([index.name for index in index_ddls]):
+        logger.info(f"  ⚠️  {index_name} is INVALID after a failed concurrent build; DROP INDEX it and re-run")
+
+
+def cmd_precheck() -> int:
+    logger.info("🔍 Running PostgreSQL constraint pre-checks...")
+    with engine.begin() as connection:
+        blocked, _ready = _load_precheck(connection)
+    _print_precheck_report(blocked)
+    return 1 if blocked else 0
+
+
+def cmd_dedupe(backup_file: str | None, only=None) -> int:
+    if backup_file and not _maybe_run_backup(backup_file):
         return 2
+    if not backup_file:
+        logger.info("\n⚠️  Auto-fix is running without backup. Recommended: re-run with --backup-file <path>")
 
+    _ensure_indexes("dedupe-support", DEDUPE_SUPPORT_INDEXES)
+    _run_auto_fix(only=only)
+    return 0
+
+
+def cmd_create_indexes(only_name: str | None = None, concurrently: bool = True) -> int:
+    with engine.begin() as connection:
+        blocked, ready = _load_precheck(connection)
+
+    index_ddls = [IndexDDL(check.name, check.create_stmt) for check in ready] + NON_UNIQUE_INDEXES
+    if only_name:
+        index_ddls = [item for item in index_ddls if item.name == only_name]
+        if not index_ddls:
+            logger.info(f"❌ Unknown or blocked index: {only_name}")
+            return 2
+
+    _ensure_indexes("target", index_ddls, concurrently=concurrently)
+
+    if blocked and not only_name:
+        logger.info("\n⚠️  Some unique indexes were skipped due to duplicates. Run dedupe, then re-run.")
+        return 1
+    return 0
+
+
+def run(apply_changes: bool, auto_fix: bool, backup_file: str | None, concurrently: bool = True) -> int:
+    """Compose the individual steps into the classic all-in-one flow."""
     if auto_fix and not apply_changes:
-        print("❌ --auto-fix requires --apply")
+        logger.info("❌ --auto-fix requires --apply")
         return 2
 
-    print("🔍 Running PostgreSQL constraint pre-checks...")
+    logger.info("🔍 Running PostgreSQL constraint pre-checks...")
 
     with engine.begin() as connection:
         blocked, ready = _load_precheck(connection)
 
-    if blocked:
-        print("\n⚠️  Duplicate data detected. These unique indexes are blocked:")
-        for check, count in blocked:
-            print(f"  - {check.name}: {count} duplicate group(s) found ({check.description})")
-    else:
-        print("\n✅ No duplicate groups found for targeted unique constraints")
-
-    print("\n📋 Planned unique indexes:")
-    for check in UNIQUE_CHECKS:
-        status = "BLOCKED" if any(item[0].name == check.name for item in blocked) else "READY"
-        print(f"  - {check.name}: {status}")
+    _print_precheck_report(blocked)
 
     if not apply_changes:
-        print("\nℹ️  Dry run only. Re-run with --apply to execute safe index creation.")
+        logger.info("\nℹ️  Dry run only. Re-run with --apply to execute safe index creation.")
         return 1 if blocked else 0
 
     if auto_fix and blocked:
-        if backup_file and not _maybe_run_backup(backup_file):
-            return 2
-        elif not backup_file:
-            print("\n⚠️  Auto-fix is running without backup. Recommended: re-run with --backup-file <path>")
-
-        with engine.begin() as connection:
-            _run_auto_fix(connection)
+        result = cmd_dedupe(backup_file)
+        if result:
+            return result
 
         with engine.begin() as connection:
             blocked, ready = _load_precheck(connection)
 
-        print("\n🔁 Re-check after auto-fix:")
+        logger.info("\n🔁 Re-check after auto-fix:")
         if blocked:
             for check, count in blocked:
-                print(f"  - {check.name}: still blocked with {count} duplicate group(s)")
+                logger.info(f"  - {check.name}: still blocked with {count} duplicate group(s)")
         else:
-            print("  ✅ All target unique constraints are now clean")
-
-    print("\n🚀 Applying safe indexes...")
-    with engine.begin() as connection:
-        for check in ready:
-            connection.execute(text(check.create_sql))
-            print(f"  ✅ Applied {check.name}")
+            logger.info("  ✅ All target unique constraints are now clean")
 
-        for index_name, create_sql in NON_UNIQUE_INDEXES:
-            connection.execute(text(create_sql))
-            print(f"  ✅ Ensured {index_name}")
+    logger.info("\n🚀 Applying safe indexes...")
+    _ensure_indexes("unique", [IndexDDL(check.name, check.create_stmt) for check in ready], concurrently=concurrently)
+    _ensure_indexes("lookup", NON_UNIQUE_INDEXES, concurrently=concurrently)
 
     if blocked:
-        print("\n⚠️  Migration applied partially. Resolve remaining duplicates, then re-run with --apply.")
+        logger.info("\n⚠️  Migration applied partially. Resolve remaining duplicates, then re-run with --apply.")
         return 1
 
-    print("\n🎉 All targeted PostgreSQL constraints/indexes are applied safely.")
+    logger.info("\n🎉 All targeted PostgreSQL constraints/indexes are applied safely.")
     return 0
 
 
@@ -447,10 +759,51 @@ def main():
         "--backup-file",
         type=str,
         default=None,
-        help="Path for pg_dump backup file before auto-fix (recommended)",
+        help="Path prefix for per-table COPY backup files before auto-fix (recommended)",
+    )
+    parser.add_argument(
+        "--no-concurrently",
+        action="store_true",
+        help="Build all indexes in one server-side batch with full table locks (fresh/offline databases only)",
     )
+
+    subparsers = parser.add_subparsers(
+        dest="command",
+        help="Run one migration step instead of the full flow (suitable for background jobs)",
+    )
+    subparsers.add_parser("precheck", help="Report duplicate status for target unique constraints (read-only)")
+    dedupe_parser = subparsers.add_parser("dedupe", help="Run the deterministic duplicate auto-fix in short transactions")
+    dedupe_parser.add_argument(
+        "--only",
+        action="append",
+        choices=sorted(DEDUPE_STEPS),
+        help="Restrict the auto-fix to specific step(s); repeatable",
+    )
+    create_parser = subparsers.add_parser("create-indexes", help="Create unique indexes that pass pre-checks plus lookup indexes")
+    create_parser.add_argument("--name", default=None, help="Create only the named index")
+
     args = parser.parse_args()
-    raise SystemExit(run(apply_changes=args.apply, auto_fix=args.auto_fix, backup_file=args.backup_file))
+
+    try:
+        if not _require_postgres():
+            result = 2
+        elif args.command == "precheck":
+            result = cmd_precheck()
+        elif args.command == "dedupe":
+            result = cmd_dedupe(args.backup_file, only=args.only)
+        elif args.command == "create-indexes":
+            result = cmd_create_indexes(args.name, concurrently=not args.no_concurrently)
+        else:
+            result = run(
+                apply_changes=args.apply,
+                auto_fix=args.auto_fix,
+                backup_file=args.backup_file,
+                concurrently=not args.no_concurrently,
+            )
+    finally:
+        _log_handler.flush()
+
+    raise SystemExit(result)
 
 
 if __name__ == "__main__":
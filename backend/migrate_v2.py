@@ -5,14 +5,19 @@ This script uses SQLAlchemy metadata to create any missing tables for the
 current model set. It intentionally does not drop tables or data.
 """
 
+import argparse
 import os
-import shutil
+import sqlite3
 from datetime import datetime
 
 from sqlalchemy import inspect, text
 
 from app.db.database import engine, Base
 
+# Imported for its side effect: registering every model on Base.metadata.
+# Without this, create_all() sees empty metadata and emits no DDL.
+import app.models.models  # noqa: F401
+
 
 DB_PATH = "quizapp.db"
 BACKUP_PATH = f"quizapp_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
@@ -21,20 +26,42 @@ BACKUP_PATH = f"quizapp_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
 def backup_database():
     """Create a backup of SQLite database before migration."""
     if os.path.exists(DB_PATH):
-        shutil.copy2(DB_PATH, BACKUP_PATH)
+        # SQLite's online backup API copies under a read lock (safe against
+        # concurrent writers, WAL-aware) and skips unused pages, unlike a
+        # raw file copy which can tear mid-transaction.
+        src = sqlite3.connect(DB_PATH)
+        dst = sqlite3.connect(BACKUP_PATH)
+        try:
+            src.backup(dst, pages=1024)
+        finally:
+            dst.close()
+            src.close()
         print(f"✅ Database backed up to: {BACKUP_PATH}")
         return True
     return False
 
 
-def migrate_database():
+def migrate_database(inspector, fresh=False):
     """Create missing tables using current SQLAlchemy metadata."""
     print("\n🔄 Starting safe schema migration...")
-    Base.metadata.create_all(bind=engine)
-
-    inspector = inspect(engine)
-    existing_indexes = {idx["name"] for idx in inspector.get_indexes("answers")}
-    existing_indexes.update({idx["name"] for idx in inspector.get_indexes("quiz_assignments")})
+    if fresh:
+        # Brand-new database: skip per-table existence reflection entirely.
+        Base.metadata.create_all(bind=engine, checkfirst=False)
+    else:
+        # One reflection round trip; create only what is actually missing.
+        existing_tables = set(inspector.get_table_names())
+        missing_tables = [
+            table for name, table in Base.metadata.tables.items() if name not in existing_tables
+        ]
+        if missing_tables:
+            Base.metadata.create_all(bind=engine, tables=missing_tables, checkfirst=False)
+
+    # One catalog round-trip for all index metadata instead of a
+    # get_indexes() query per table.
+    all_indexes = inspector.get_multi_indexes(filter_names=["answers", "quiz_assignments"])
+    existing_indexes = {
+        idx["name"] for table_indexes in all_indexes.values() for idx in table_indexes
+    }
 
     statements = []
     if "uq_answers_attempt_question" not in existing_indexes:
@@ -62,13 +89,17 @@ def migrate_database():
                 except Exception as error:
                     print(f"⚠️  Skipping index statement due to error: {error}")
 
+    # The inspector memoizes reflection results, so drop its cache now
+    # that DDL has run — otherwise verify_migration() reports the tables
+    # created above as missing.
+    inspector.clear_cache()
+
     print("✅ Migration completed successfully!")
 
 
-def verify_migration():
+def verify_migration(inspector):
     """Verify presence of core tables for current backend features."""
     print("\n🔍 Verifying migration...")
-    inspector = inspect(engine)
     table_names = set(inspector.get_table_names())
 
     expected_tables = {
@@ -99,6 +130,14 @@ def verify_migration():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MacQuiz safe schema migration")
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Target database is known empty: create all tables without existence checks",
+    )
+    args = parser.parse_args()
+
     print("=" * 60)
     print("MacQuiz Safe Schema Migration")
     print("=" * 60)
@@ -108,8 +147,11 @@ if __name__ == "__main__":
     else:
         print("ℹ️  No SQLite file found to backup (skipping backup)")
 
-    migrate_database()
-    verify_migration()
+    # Shared inspector for both passes. Its results are memoized, so
+    # migrate_database() clears the cache after running DDL.
+    inspector = inspect(engine)
+    migrate_database(inspector, fresh=args.fresh)
+    verify_migration(inspector)
 
     print("\n" + "=" * 60)
     print("🎉 Migration process completed!")